@@ -3,44 +3,113 @@
 mesh2vtk: Converts an ANSYS Finite Element Model into a vtu file
 
 usage: mesh2vtk.py [-h] --inputfile INPUTFILE --outputfile OUTPUTFILE [--ascii] [--fem_node_string] [--fem_element_string]
+                   [--element_quality] [--fem_components [{mask,bits}]] [--results RESULTFILE [RESULTFILE ...]]
+                   [--watch]
 
 options:
   -h, --help            show this help message and exit
   --inputfile INPUTFILE
-                        Path to the input file.
+                        Path to the input file (optionally gzip, bzip2, xz or zstd compressed), '-' reads from stdin.
   --outputfile OUTPUTFILE
                         Path to the output vtu file.
   --ascii               Optional: Data mode of vtu file. BINARY set as default mode. If this argument is passed data
                         mode will be set to ASCII.
   --fem_node_string     Optional: Map FEM node id to vtu file.
   --fem_element_string  Optional: Map FEM element id to vtu file.
+  --element_quality     Optional: Write element quality metrics (cell size, aspect ratio, scaled jacobian and
+                        collapsed node flag) to vtu file.
+  --fem_components [{mask,bits}]
+                        Optional: Map named components (CMBLOCK) to vtu file. "mask" (default) writes one uint8 mask
+                        array per component, "bits" writes one bit-packed component field per entity type.
+  --results RESULTFILE [RESULTFILE ...]
+                        Optional: Nodal result files (PRNSOL text export or Nastran punch file) keyed by FEM node id.
+                        All steps are written to one transient VTKHDF file next to the vtu file, the mesh geometry is
+                        stored once.
+  --watch               Optional: Watch the input file and reconvert it on every change. Only blocks (nblock,
+                        et/eblock, cmblock) that changed are parsed again.
+
+library usage:
+  from mesh2vtk import read_ansys
+  mesh = read_ansys(source)     # file path, bytes or file-like object (optionally compressed), no output
+  mesh.points, mesh.connectivity, mesh.offsets, mesh.cell_types, mesh.fem_node_ids, mesh.fem_element_ids
+  ugrid = mesh.to_vtk()         # vtkUnstructuredGrid sharing memory with the mesh arrays (pyvista.wrap(ugrid))
   
 '''
 
 import vtk
+from vtk.util import numpy_support
+from vtk.util.vtkAlgorithm import VTKPythonAlgorithmBase
 import numpy as np
 import argparse
+import bz2
+import codecs
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import queue
+import re
+import sys
+import threading
 import time
-
-
-class Node:
-    def __init__(self, nid: int, vtk_nid: int):
-        self.nid = nid
-        self.vtk_nid = vtk_nid
-        self.coordinates = []
-
-
-class Element:
-    def __init__(self, eid: int, vtk_eid: int):
-        self.eid = eid
-        self.vtk_eid = vtk_eid
-        self.attached_nodes = []
+import warnings
+
+
+class Mesh:
+    def __init__(self, points: np.ndarray, fem_node_ids: np.ndarray, cell_types: np.ndarray, offsets: np.ndarray,
+                 connectivity: np.ndarray, fem_element_ids: np.ndarray, components: dict):
+        self.points = points                    # (n_points, 3) float32
+        self.fem_node_ids = fem_node_ids        # (n_points,) int32
+        self.cell_types = cell_types            # (n_cells,) uint8, VTK cell types
+        self.offsets = offsets                  # (n_cells + 1,) vtkIdType, cell offsets into connectivity
+        self.connectivity = connectivity        # vtkIdType, point ids of all cells
+        self.fem_element_ids = fem_element_ids  # (n_cells,) int32
+        self.components = components            # {name: (entity 'NODE' or 'ELEM', fem ids)}
+
+    def to_vtk(self, fem_node_string=True, fem_element_string=True):
+        # vtkUnstructuredGrid sharing memory with the mesh arrays (no copy), the mesh has to outlive the grid
+        vtk_points = vtk.vtkPoints()
+        vtk_points.SetData(numpy_support.numpy_to_vtk(self.points, deep=0))
+
+        vtk_cells = vtk.vtkCellArray()
+        vtk_cells.SetData(numpy_support.numpy_to_vtkIdTypeArray(self.offsets, deep=0),
+                          numpy_support.numpy_to_vtkIdTypeArray(self.connectivity, deep=0))
+
+        ugrid = vtk.vtkUnstructuredGrid()
+        ugrid.SetPoints(vtk_points)
+        ugrid.SetCells(numpy_support.numpy_to_vtk(self.cell_types, deep=0), vtk_cells)
+
+        # Mapping of FEM node and element ids to vtu model
+        if fem_node_string:
+            fem_node_id = numpy_support.numpy_to_vtk(self.fem_node_ids, deep=0)
+            fem_node_id.SetName("FEM_NODE_ID")
+            ugrid.GetPointData().AddArray(fem_node_id)
+
+        if fem_element_string:
+            fem_element_id = numpy_support.numpy_to_vtk(self.fem_element_ids, deep=0)
+            fem_element_id.SetName("FEM_ELEMENT_ID")
+            ugrid.GetCellData().AddArray(fem_element_id)
+
+        return ugrid
+
+
+VTK_CELL_TYPE = {
+    "quad": 9,
+    "tria": 5,
+    "tetra4": 10,
+    "hexa": 12,
+    "wedge": 13,
+    "tetra10": 24,
+    "hexa20": 25,
+}
 
 
 def ParseArgs():
     parser = argparse.ArgumentParser(description='A python tool that converts a (general purpose) Finite Element '
                                                  'Model to a VTK model')
-    parser.add_argument("--inputfile", help="Path to the input file.", required=True, type=str, action='store')
+    parser.add_argument("--inputfile", help="Path to the input file (optionally gzip, bzip2, xz or zstd compressed), "
+                                             "'-' reads from stdin.", required=True, type=str, action='store')
     parser.add_argument("--outputfile", help="Path to the output vtu file.", required=True, type=str, action='store')
     parser.add_argument('--ascii', action='store_true', default=False, help='Optional: Data mode of vtu file. BINARY '
                                                                             'set as default mode. If this argument is '
@@ -49,255 +118,820 @@ def ParseArgs():
                         help='Optional: Map FEM node id to vtu file.')
     parser.add_argument('--fem_element_string', action='store_true', default=False,
                         help='Optional: Map FEM element id to vtu file.')
+    parser.add_argument('--element_quality', action='store_true', default=False,
+                        help='Optional: Write element quality metrics (cell size, aspect ratio, scaled jacobian and '
+                             'collapsed node flag) to vtu file.')
+    parser.add_argument('--fem_components', nargs='?', const='mask', default=None, choices=['mask', 'bits'],
+                        help='Optional: Map named components (CMBLOCK) to vtu file. "mask" (default) writes one uint8 '
+                             'mask array per component, "bits" writes one bit-packed component field per entity '
+                             'type.')
+    parser.add_argument('--results', nargs='+', default=None, type=str, metavar='RESULTFILE',
+                        help='Optional: Nodal result files (PRNSOL text export or Nastran punch file) keyed by FEM '
+                             'node id. All steps are written to one transient VTKHDF file next to the vtu file, the '
+                             'mesh geometry is stored once.')
+    parser.add_argument('--watch', action='store_true', default=False,
+                        help='Optional: Watch the input file and reconvert it on every change. Only blocks (nblock, '
+                             'et/eblock, cmblock) that changed are parsed again.')
     args = parser.parse_args()
 
     return args
 
 
-def parse_ansys_file(inputfile):
+# Compressed input formats detected by their magic bytes
+COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bzip2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+]
 
-    # Read entire input file and save to a list
-    with open(inputfile) as f:
-        lines = [line.rstrip() for line in f]
+INPUT_BUFFER_SIZE = 1 << 20
+INPUT_QUEUE_SIZE = 8
 
-    elem_type_list = []
-    vtk_nid = 0
-    vtk_eid = 0
+WATCH_INTERVAL = 0.5
 
-    nodes = {}
-    elements = {}
 
-    grid_count = 0
+def open_decompressed(fileobj):
+    # Wraps a binary file object with the matching decompressor, uncompressed input is returned as is
+    if not hasattr(fileobj, 'peek'):
+        fileobj = io.BufferedReader(fileobj)
+    magic = fileobj.peek(6)[:6]
 
-    bNodes = False
-    bElems = False
+    for signature, compression in COMPRESSION_MAGIC:
+        if not magic.startswith(signature):
+            continue
+
+        if compression == 'gzip':
+            return gzip.GzipFile(fileobj=fileobj)
+        elif compression == 'bzip2':
+            return bz2.BZ2File(fileobj)
+        elif compression == 'xz':
+            return lzma.LZMAFile(fileobj)
+        else:
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError('Reading zstd compressed input requires the zstandard package: '
+                                  'pip install zstandard')
+            return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+    return fileobj
+
+
+class InputStream:
+    def __init__(self, source):
+        # source: file path, '-' (stdin), bytes or (text or binary) file-like object, optionally compressed
+        self.source = source
+        self.bytes_read = 0
+        self.elapsed = 0.
+
+    def open(self):
+        # Returns the (decompressed) file object and whether it has to be closed after reading
+        if isinstance(self.source, (bytes, bytearray, memoryview)):
+            return open_decompressed(io.BytesIO(bytes(self.source))), True
+        elif isinstance(self.source, str) and self.source == '-':
+            return open_decompressed(sys.stdin.buffer), False
+        elif isinstance(self.source, io.TextIOBase):
+            return self.source, False
+        elif hasattr(self.source, 'read'):
+            return open_decompressed(self.source), False
+        else:
+            return open_decompressed(open(self.source, 'rb')), True
+
+    def __iter__(self):
+        # Decompression runs on a background thread that feeds fixed-size buffers through a bounded queue,
+        # the lines are split (and parsed by the caller) while the next buffers are decompressed
+        start_time = time.time()
+        f, close = self.open()
+        buffers = queue.Queue(maxsize=INPUT_QUEUE_SIZE)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    buffers.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def read_buffers():
+            try:
+                while not stop.is_set():
+                    buffer = f.read(INPUT_BUFFER_SIZE)
+                    if not buffer:
+                        break
+                    put(buffer)
+                put(None)
+            except Exception as e:
+                put(e)
+
+        reader = threading.Thread(target=read_buffers, daemon=True)
+        reader.start()
+
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        pending = ''
+        try:
+            while True:
+                buffer = buffers.get()
+                if buffer is None:
+                    break
+                elif isinstance(buffer, Exception):
+                    raise buffer
+
+                self.bytes_read += len(buffer)
+                lines = (pending + (buffer if isinstance(buffer, str) else decoder.decode(buffer))).split('\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield line.rstrip()
+
+            pending += decoder.decode(b'', final=True)
+            if pending:
+                yield pending.rstrip()
+        finally:
+            stop.set()
+            reader.join()
+            if close:
+                f.close()
+            self.elapsed = time.time() - start_time
+
+
+# Field width of the CMBLOCK id list if the block has no format line
+CMBLOCK_FIELD_WIDTH = 10
+
+
+def split_ansys_blocks(lines):
+    # Splits the input lines into the blocks of the model: 'nblock' (nodes), 'et' (element type and its eblock)
+    # and 'cmblock' (named component). All other lines are skipped.
+    kind = None
+    block = []
+    cm_count = 0
+    cm_width = CMBLOCK_FIELD_WIDTH
 
-    temp = []
-    elems_line_181 = []
-    elems_line_187 = []
-    elems_line_186 = []
-    elems_line_185 = []
-    elem_type_list = []
-    
     for line in lines:
-        
-        #**** parse nodes
+
         if line.strip().lower().startswith('nblock'):
-            bNodes = True
-        elif bNodes and not line.startswith('-1'):
+            if kind:
+                yield kind, block
+            kind, block = 'nblock', [line]
+        elif kind == 'nblock' and not line.startswith('-1'):
+            block.append(line)
+
+        elif line.strip().lower().startswith('et,'):
+            if kind:
+                yield kind, block
+            kind, block = 'et', [line]
+        elif kind == 'et' and not line.startswith('-1'):
+            block.append(line)
+
+        elif line.strip().lower().startswith('cmblock'):
+            if kind:
+                yield kind, block
+            kind = None
+            try:
+                cm_count = cmblock_header(line)[2]
+            except (IndexError, ValueError):
+                warnings.warn(f'Skipping CMBLOCK with invalid header: {line.strip()}')
+                continue
+
+            kind, block = 'cmblock', [line]
+            cm_width = CMBLOCK_FIELD_WIDTH
+            if cm_count <= 0:
+                yield kind, block
+                kind = None
+        elif kind == 'cmblock':
+            block.append(line)
+            if line.strip().startswith('('):
+                cm_width = cmblock_field_width(line)
+            else:
+                cm_count -= sum(1 for j in range(0, len(line), cm_width) if line[j:j+cm_width].strip())
+            if cm_count <= 0:
+                yield kind, block
+                kind = None
+
+        elif kind:
+            yield kind, block
+            kind = None
+
+    if kind:
+        yield kind, block
+
+
+def parse_nblock(block):
+    # Returns the FEM node ids and coordinates of a nblock
+    fem_nids = []
+    coordinates = []
+
+    for line in block[1:]:
+        if line.strip().startswith('('):
+            continue
+
+        fem_nids.append(int(line[0:9]))
+        coordinates.append([float(field) if field.strip() else 0. for field in (line[10:30], line[30:50], line[50:70])])
+
+    return np.array(fem_nids, dtype=np.int64), np.array(coordinates, dtype=np.float32).reshape(-1, 3)
+
+
+def parse_element_block(block):
+    # Returns the element type, FEM element ids, number of nodes per element and the FEM node ids of all elements
+    etype_no = block[0].split(',')[2]
+
+    lines = [line for line in block[1:] if not (line.strip().startswith('(') or line.strip().startswith('eblock') or
+                                                line.strip().startswith('keyo'))]
+    fem_eids = []
+    attached_nodes = []
+
+    if etype_no == '181':  # shell elements
+        for line in lines:
+            fem_eids.append(int(line[91:99]))
+            attached_nodes_1st_line = [int(line[99:135][j:j+9]) for j in range(0, len(line[99:135]), 9)]
+
+            # for 3-node shell element
+            if len(set(attached_nodes_1st_line[2:])) == 1:
+                attached_nodes_1st_line = attached_nodes_1st_line[0:3]
+
+            attached_nodes.append(attached_nodes_1st_line)
+
+    elif etype_no == '185':  # 8 node solid element (hex)
+        for line in lines:
+            fem_eids.append(int(line[91:99]))
+            attached_nodes_1st_line = [int(line[99:173][j:j+9]) for j in range(0, len(line[99:173]), 9)]
+
+            # for 4-node tet element
+            if len(set(attached_nodes_1st_line[4:])) == 1:
+                attached_nodes_1st_line = attached_nodes_1st_line[0:3] + [attached_nodes_1st_line[5]]
+
+            attached_nodes.append(attached_nodes_1st_line)
+
+    elif etype_no in ('186', '187'):  # 20 node solid element (hex), 2nd order tetra element (10 nodes)
+        for i in range(0, len(lines) - 1, 2):
+            fem_eids.append(int(lines[i][91:99]))
+            attached_nodes_1st_line = [int(lines[i][99:173][j:j+9]) for j in range(0, len(lines[i][99:173]), 9)]
+            attached_nodes_2nd_line = [int(lines[i+1][j:j+9]) for j in range(0, len(lines[i+1]), 9)]
+
+            attached_nodes.append(attached_nodes_1st_line + attached_nodes_2nd_line)
+
+    cell_sizes = np.array([len(nodes) for nodes in attached_nodes], dtype=np.int64)
+    connectivity = np.array([nid for nodes in attached_nodes for nid in nodes], dtype=np.int64)
+
+    return etype_no, np.array(fem_eids, dtype=np.int64), cell_sizes, connectivity
+
+
+def cmblock_header(line):
+    # Name, entity and number of ids of a CMBLOCK header line, a trailing '!' comment is ignored
+    cm_fields = line.split('!')[0].split(',')
+    return cm_fields[1].strip(), cm_fields[2].strip().upper(), int(cm_fields[3])
+
+
+def cmblock_field_width(line):
+    # Field width of a CMBLOCK format line, e.g. 10 for (8i10)
+    match = re.match(r'\(\s*\d*\s*i\s*(\d+)', line.strip(), re.IGNORECASE)
+    return int(match.group(1)) if match else CMBLOCK_FIELD_WIDTH
+
+
+def parse_cmblock(block):
+    # Returns the name, entity ('NODE' or 'ELEM') and the expanded FEM ids of a named component,
+    # or None (with a warning) if the id list can not be read
+    cm_name, entity, _ = cmblock_header(block[0])
+    cm_width = CMBLOCK_FIELD_WIDTH
+    cm_ids = []
+
+    try:
+        for line in block[1:]:
             if line.strip().startswith('('):
+                cm_width = cmblock_field_width(line)
                 continue
-            
-            fem_nid = line[0:9].strip()
-            grid_count += 1
+            cm_ids.extend(int(line[j:j+cm_width]) for j in range(0, len(line), cm_width) if line[j:j+cm_width].strip())
+    except ValueError:
+        warnings.warn(f'Skipping CMBLOCK {cm_name} with invalid id list')
+        return None
+
+    # Every range end -b has to follow a positive start a with b >= a
+    cm_ids = np.array(cm_ids, dtype=np.int64)
+    is_range_end = cm_ids[1:] < 0
+    if len(cm_ids) and (cm_ids[0] < 0 or np.any(cm_ids[:-1][is_range_end] <= 0)
+                        or np.any(-cm_ids[1:][is_range_end] < cm_ids[:-1][is_range_end])):
+        warnings.warn(f'Skipping CMBLOCK {cm_name} with invalid id range')
+        return None
+
+    return cm_name, entity, expand_component_ids(cm_ids)
+
+
+BLOCK_PARSERS = {
+    'nblock': parse_nblock,
+    'et': parse_element_block,
+    'cmblock': parse_cmblock,
+}
+
+
+def parse_ansys_file(inputfile, block_cache=None):
+    # Parses the input file block by block. Every block is hashed, blocks found in block_cache (hash -> parsed
+    # block) are not parsed again. Returns the Mesh, the block cache of the input file and the block hashes in file
+    # order.
+    lines = inputfile if isinstance(inputfile, InputStream) else InputStream(inputfile)
+    block_cache = block_cache if block_cache is not None else {}
+
+    blocks = []
+    block_hashes = []
+    new_block_cache = {}
+    for kind, block in split_ansys_blocks(lines):
+        block_hash = (kind, hashlib.blake2b('\n'.join(block).encode(), digest_size=16).hexdigest())
+        if block_hash in block_cache:
+            parsed_block = block_cache[block_hash]
+        elif block_hash in new_block_cache:
+            parsed_block = new_block_cache[block_hash]
+        else:
+            parsed_block = BLOCK_PARSERS[kind](block)
+        new_block_cache[block_hash] = parsed_block
+        block_hashes.append(block_hash)
+        blocks.append((kind, parsed_block))
 
-            x_coord = line[10:30].strip()
-            y_coord = line[30:50].strip()
-            z_coord = line[50:70].strip()
+    return assemble_mesh(blocks), new_block_cache, block_hashes
 
-            nodes[fem_nid] = Node(fem_nid, vtk_nid)
-            nodes[fem_nid].coordinates = np.array([x_coord, y_coord, z_coord], dtype=np.float32)
 
-            vtk_nid = vtk_nid + 1
-    
-        #**** parse elements
-        elif line.strip().lower().startswith('et,'): 
-            etype_no = line.split(',')[2]
-            elem_type_list.append(etype_no)
+def vtk_cell_type(n_nodes, elem_type_list):
+
+    # Quad elements
+    if n_nodes == 4 and '181' in elem_type_list:
+        return VTK_CELL_TYPE["quad"]
+
+    # Tria elements
+    elif n_nodes == 3 and '181' in elem_type_list:
+        return VTK_CELL_TYPE["tria"]
+
+    # Tetra elements
+    elif n_nodes == 4 and '185' in elem_type_list:
+        return VTK_CELL_TYPE["tetra4"]
+
+    # Hexa elements
+    elif n_nodes == 8 and '185' in elem_type_list:
+        return VTK_CELL_TYPE["hexa"]
+
+    # Tetrahedra (2nd order) elements
+    elif n_nodes == 10 and '187' in elem_type_list:
+        return VTK_CELL_TYPE["tetra10"]
+
+    # Hexahedra (2nd order) elements
+    elif n_nodes == 20 and '186' in elem_type_list:
+        return VTK_CELL_TYPE["hexa20"]
+
+    # Penta elements (SOON AVAILABLE)
+    elif n_nodes == 6 and 'CPENTA' in elem_type_list:
+        return VTK_CELL_TYPE["wedge"]
+
+    # Pyramid elements (SOON AVAILABLE)
+
+    return None
+
+
+def assemble_mesh(blocks):
+    # Builds the Mesh arrays from the parsed blocks. Points are numbered in input order, cells are ordered by
+    # element type (181, 185, 186, 187) and in input order within each type.
+    node_blocks = [parsed_block for kind, parsed_block in blocks if kind == 'nblock']
+    element_blocks = [parsed_block for kind, parsed_block in blocks if kind == 'et']
+
+    fem_node_ids = np.concatenate([np.zeros(0, dtype=np.int64)] + [fem_nids for fem_nids, _ in node_blocks])
+    points = np.concatenate([np.zeros((0, 3), dtype=np.float32)] + [coordinates for _, coordinates in node_blocks])
+
+    elem_type_list = [etype_no for etype_no, _, _, _ in element_blocks]
+    element_blocks = [element_block for etype_no in ('181', '185', '186', '187')
+                      for element_block in element_blocks if element_block[0] == etype_no]
+
+    fem_eids = np.concatenate([np.zeros(0, dtype=np.int64)] + [block[1] for block in element_blocks])
+    cell_sizes = np.concatenate([np.zeros(0, dtype=np.int64)] + [block[2] for block in element_blocks])
+    fem_connectivity = np.concatenate([np.zeros(0, dtype=np.int64)] + [block[3] for block in element_blocks])
+
+    # Cell type by number of nodes, elements of unsupported types are not converted
+    cell_types = np.zeros(len(cell_sizes), dtype=np.uint8)
+    for n_nodes in np.unique(cell_sizes):
+        cell_types[cell_sizes == n_nodes] = vtk_cell_type(n_nodes, elem_type_list) or 0
+    supported = cell_types > 0
+    supported_nodes = np.repeat(supported, cell_sizes)
+
+    # FEM node ids of the cells to point ids through the FEM-id index
+    connectivity = map_fem_ids(fem_id_index(fem_node_ids), fem_connectivity[supported_nodes])
+    if np.any(connectivity < 0):
+        raise KeyError(f'Element node {fem_connectivity[supported_nodes][connectivity < 0][0]} is not defined')
+
+    id_type = numpy_support.get_numpy_array_type(vtk.VTK_ID_TYPE)
+    offsets = np.concatenate((np.zeros(1, dtype=id_type), np.cumsum(cell_sizes[supported], dtype=id_type)))
 
-            bNodes = False
-            bElems = True
+    components = {}
+    for kind, parsed_block in blocks:
+        if kind == 'cmblock' and parsed_block is not None:
+            cm_name, entity, cm_ids = parsed_block
+            components[cm_name] = (entity, cm_ids)
 
-        elif bElems and not line.startswith('-1'):
-            if line.strip().startswith('(') or line.strip().startswith('eblock') or line.strip().startswith('keyo'):
+    return Mesh(points, fem_node_ids.astype(np.int32), cell_types[supported], offsets, connectivity.astype(id_type),
+                fem_eids[supported].astype(np.int32), components)
+
+
+def read_ansys(source):
+    # Library entry point: parses an ANSYS input file (file path, bytes or file-like object, optionally
+    # compressed) into a Mesh, without writing any file or output. Use Mesh.to_vtk() for a vtkUnstructuredGrid
+    # sharing the arrays.
+    mesh, _, _ = parse_ansys_file(source)
+    return mesh
+
+
+def expand_component_ids(cm_ids):
+    # A negative entry -b following a positive entry a encodes the range a through b
+    if len(cm_ids) == 0:
+        return cm_ids
+
+    start = cm_ids[cm_ids > 0]
+    is_range_end = np.append(cm_ids[1:] < 0, False)[cm_ids > 0]
+    end = start.copy()
+    end[is_range_end] = -cm_ids[np.flatnonzero(cm_ids < 0)]
+
+    lengths = end - start + 1
+    offsets = np.repeat(start - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+
+    return np.arange(lengths.sum(), dtype=np.int64) + offsets
+
+
+def fem_id_index(fem_ids):
+    # FEM-id index: sorted FEM ids and the vtk ids in the same order, for vectorized id lookups
+    sorter = np.argsort(fem_ids, kind='stable')
+    return fem_ids[sorter], sorter
+
+
+def map_fem_ids(index, ids):
+    # Map FEM ids to vtk ids through the FEM-id index, FEM ids missing in the model are mapped to -1
+    sorted_fem_ids, vtk_ids = index
+    if len(sorted_fem_ids) == 0:
+        return np.full(len(ids), -1, dtype=np.int64)
+
+    position = np.minimum(np.searchsorted(sorted_fem_ids, ids), len(sorted_fem_ids) - 1)
+    found = sorted_fem_ids[position] == ids
+    return np.where(found, vtk_ids[position], -1)
+
+
+def component_arrays(mesh, bit_packed=False):
+    # Returns the point and cell data arrays (name -> numpy array) of the named components and the component names
+    # of the bit-packed fields (field name -> list of component names)
+    point_arrays = {}
+    cell_arrays = {}
+    field_names = {}
+    components = mesh.components
+
+    for entity, fem_ids, arrays, packed_name in [
+            ("NODE", mesh.fem_node_ids, point_arrays, "FEM_NODE_COMPONENTS"),
+            ("ELEM", mesh.fem_element_ids, cell_arrays, "FEM_ELEMENT_COMPONENTS")]:
+        names = [cm_name for cm_name in components.keys() if components[cm_name][0] == entity]
+        if not names:
+            continue
+
+        index = fem_id_index(fem_ids)
+        masks = []
+        for cm_name in names:
+            vtk_ids = map_fem_ids(index, components[cm_name][1])
+            mask = np.zeros(len(fem_ids), dtype=np.uint8)
+            mask[vtk_ids[vtk_ids >= 0]] = 1
+            masks.append(mask)
+
+        if bit_packed and len(names) <= 64:
+            # One integer field per entity type, bit i is set for members of component names[i]
+            dtype = np.uint8 if len(names) <= 8 else np.uint16 if len(names) <= 16 else \
+                np.uint32 if len(names) <= 32 else np.uint64
+            bits = np.left_shift(np.ones(len(names), dtype=dtype), np.arange(len(names), dtype=dtype))
+            arrays[packed_name] = (np.stack(masks, axis=1).astype(dtype) * bits).sum(axis=1, dtype=dtype)
+            field_names[packed_name + "_NAMES"] = names
+        else:
+            if bit_packed:
+                print(f'More than 64 {entity} components, writing uint8 masks instead of a bit-packed field')
+            for cm_name, mask in zip(names, masks):
+                arrays["CM_" + cm_name] = mask
+
+    return point_arrays, cell_arrays, field_names
+
+
+def parse_prnsol_file(resultfile):
+    # Streams an ANSYS PRNSOL listing (or a tabular text export) and yields one step per load step, substep and
+    # time: (time, {column name: (fem node ids, values)}). The LOAD STEP/TIME header is repeated on every page of
+    # a listing, rows are added to the current step until the load step, substep or time changes.
+    load_step = None
+    time_value = None
+    step_key = None
+    columns = []
+    tables = {}
+
+    for line in InputStream(resultfile):
+        fields = line.replace(',', ' ').split()
+        if not fields:
+            continue
+
+        if line.strip().upper().startswith('LOAD STEP'):
+            # (load step, substep)
+            load_step = tuple(int(value) for value in re.findall(r'=\s*(-?\d+)', line))
+            time_value = None
+
+        elif line.strip().upper().startswith('TIME='):
+            time_value = float(fields[1]) if fields[0] == 'TIME=' else float(fields[0].split('=')[1])
+
+        elif fields[0].upper() == 'NODE' and len(fields) > 1 and not fields[1].lstrip('-').isdigit():
+            # Column names, tab separated exports may contain blanks in the column names
+            header = line.strip().split('\t') if '\t' in line else fields
+            columns = [column.strip().upper().replace(' ', '_') for column in header[1:]]
+
+        elif columns and fields[0].isdigit() and len(fields) > len(columns):
+            try:
+                row = [float(value) for value in fields[1:len(columns) + 1]]
+            except ValueError:
                 continue
-            
-            if etype_no == '187': # 2n order tetra element (10 nodes)
-                elems_line_187.append(line)
-            
-            elif etype_no == '186': # 20 node solid element (hex)
-                elems_line_186.append(line)
-                
-            elif etype_no == '185': # 8 node solid element (hex)
-                elems_line_185.append(line)
-                
-            elif etype_no == '181': # shell elements
-                elems_line_181.append(line)
-            
+
+            if (load_step, time_value) != step_key:
+                if tables:
+                    yield step_key[1], prnsol_step_fields(tables)
+                tables = {}
+                step_key = (load_step, time_value)
+
+            # Rows of the current step grouped by their columns (one table per printed item)
+            ids, values = tables.setdefault(tuple(columns), ([], []))
+            ids.append(int(fields[0]))
+            values.append(row)
+
+    if tables:
+        yield step_key[1], prnsol_step_fields(tables)
+
+
+# PRNSOL items whose X, Y, Z columns are the components of a vector (displacement, rotation, velocity,
+# acceleration, force, moment, thermal flux and gradient, electric and magnetic field). Tensor components such as
+# SX, SY, SZ of PRNSOL,S,COMP are kept as scalar fields.
+PRNSOL_VECTORS = {'U', 'ROT', 'V', 'A', 'F', 'M', 'TF', 'TG', 'EF', 'D', 'H', 'B'}
+
+
+def prnsol_step_fields(tables):
+    fields = {}
+    for columns, (ids, values) in tables.items():
+        ids = np.array(ids, dtype=np.int64)
+        values = np.array(values, dtype=np.float64).reshape(len(ids), -1)
+        for i, column in enumerate(columns):
+            fields[column] = (ids, values[:, i])
+
+    # Combine X, Y, Z components of a vector item (e.g. UX, UY, UZ) of the same table to a vector field (U)
+    for column in list(fields.keys()):
+        prefix = column[:-1]
+        if column.endswith('X') and prefix in PRNSOL_VECTORS and prefix + 'Y' in fields and prefix + 'Z' in fields and prefix not in fields and \
+                fields[prefix + 'Y'][0] is fields[column][0] and fields[prefix + 'Z'][0] is fields[column][0]:
+            fields[prefix] = (fields[column][0], np.stack([fields[prefix + c][1] for c in 'XYZ'], axis=1))
+
+    return fields
+
+
+def parse_punch_file(resultfile):
+    # Streams a Nastran punch file and yields the real displacement output of each subcase:
+    # (subcase id, {"DISPLACEMENT": (fem node ids, T1-T3), "ROTATION": (fem node ids, R1-R3)})
+    subcase = None
+    bDisplacements = False
+    ids = []
+    translations = []
+    rotations = []
+
+    def step():
+        step_ids = np.array(ids, dtype=np.int64)
+        fields = {"DISPLACEMENT": (step_ids, np.array(translations, dtype=np.float64).reshape(-1, 3))}
+        if len(rotations) == len(ids):
+            fields["ROTATION"] = (step_ids, np.array(rotations, dtype=np.float64).reshape(-1, 3))
+        return subcase, fields
+
+    for line in InputStream(resultfile):
+        if line.startswith('$'):
+            header = line[1:72].strip().upper()
+            if header.startswith('SUBCASE ID'):
+                subcase = float(header.split('=')[1])
+            elif not header.startswith(('TITLE', 'SUBTITLE', 'LABEL', 'REAL OUTPUT', 'EIGENVALUE', 'MODE')):
+                # Start of a new result block
+                if ids:
+                    yield step()
+                    ids, translations, rotations = [], [], []
+                bDisplacements = header.startswith('DISPLACEMENTS')
+            continue
+
+        if not bDisplacements:
+            continue
+
+        fields = line[:72].split()
+        if not fields:
+            continue
+        elif fields[0] == '-CONT-':
+            rotations.append([float(value) for value in fields[1:4]])
+        else:
+            ids.append(int(fields[0]))
+            translations.append([float(value) for value in fields[2:5]])
+
+    if ids:
+        yield step()
+
+
+def is_punch_file(resultfile):
+    # Nastran punch files start with a '$' header line ($TITLE, $DISPLACEMENTS, ...), detected on the
+    # decompressed content so that compressed result files (e.g. .pch.gz) are recognized as well
+    lines = iter(InputStream(resultfile))
+    try:
+        for line in lines:
+            if line.strip():
+                return line.startswith('$')
+        return False
+    finally:
+        lines.close()
+
+
+def read_results(resultfiles):
+    # Yields (time, fields) of all steps in the result files, time falls back to the step number in its file
+    for resultfile in resultfiles:
+        if is_punch_file(resultfile):
+            steps = parse_punch_file(resultfile)
         else:
-            bNodes = False
-            bElems = False
-
-    if '181' in elem_type_list:
-        for i in range(len(elems_line_181)):
-                fem_eid = elems_line_181[i][91:99].strip()
-
-                elements[fem_eid] = Element(fem_eid, vtk_eid)
-
-                attached_nodes_1st_line = [nodes[str(int(elems_line_181[i][99:135][j:j+9]))].vtk_nid for j in range(0, len(elems_line_181[i][99:135]), 9)]
-                                
-                # for 3-node shell element
-                if len(set(attached_nodes_1st_line[2:])) == 1:
-                    attached_nodes_1st_line = attached_nodes_1st_line[0:3] 
-                
-                elements[fem_eid].attached_nodes = attached_nodes_1st_line
-
-                vtk_eid = vtk_eid + 1
-
-    if '185' in elem_type_list:
-        for i in range(len(elems_line_185)):
-                fem_eid = elems_line_185[i][91:99].strip()
-
-                elements[fem_eid] = Element(fem_eid, vtk_eid)
-
-                attached_nodes_1st_line = [nodes[str(int(elems_line_185[i][99:173][j:j+9]))].vtk_nid for j in range(0, len(elems_line_185[i][99:173]), 9)]
-                                
-                # for 4-node tet element
-                if len(set(attached_nodes_1st_line[4:])) == 1:
-                    attached_nodes_1st_line = attached_nodes_1st_line[0:3] + [attached_nodes_1st_line[5]] 
-                
-                elements[fem_eid].attached_nodes = attached_nodes_1st_line
-
-                vtk_eid = vtk_eid + 1
-
-    if '186' in elem_type_list:
-        for i in range(len(elems_line_186)):
-            if i % 2 == 0: 
-                fem_eid = elems_line_186[i][91:99].strip()
-
-                elements[fem_eid] = Element(fem_eid, vtk_eid)
-
-                attached_nodes_1st_line = [nodes[str(int(elems_line_186[i][99:173][j:j+9]))].vtk_nid for j in range(0, len(elems_line_186[i][99:173]), 9)]
-                attached_nodes_2nd_line = [nodes[str(int(elems_line_186[i+1][0:][j:j+9]))].vtk_nid for j in range(0, len(elems_line_186[i+1][0:]), 9)]
-                
-                elements[fem_eid].attached_nodes = attached_nodes_1st_line + attached_nodes_2nd_line
-
-                vtk_eid = vtk_eid + 1
-                
-    if '187' in elem_type_list:
-        for i in range(len(elems_line_187)):
-            if i % 2 == 0: 
-                fem_eid = elems_line_187[i][91:99].strip()
-
-                elements[fem_eid] = Element(fem_eid, vtk_eid)
-
-                attached_nodes_1st_line = [nodes[str(int(elems_line_187[i][99:173][j:j+9]))].vtk_nid for j in range(0, len(elems_line_187[i][99:173]), 9)]
-                attached_nodes_2nd_line = [nodes[str(int(elems_line_187[i+1][0:][j:j+9]))].vtk_nid for j in range(0, len(elems_line_187[i+1][0:]), 9)]
-                
-                elements[fem_eid].attached_nodes = attached_nodes_1st_line + attached_nodes_2nd_line
-
-                vtk_eid = vtk_eid + 1
-                
-    return nodes, elements, elem_type_list, temp
-
-def write_vtk(nodes, elements, elem_type_list, outputfile, dataModeASCII, fem_node_string, fem_element_string):
-    # Define VTK Points
-    vtk_points = vtk.vtkPoints()
-    for nid in nodes.keys():
-        vtk_points.InsertNextPoint(
-            nodes[nid].coordinates[0],
-            nodes[nid].coordinates[1],
-            nodes[nid].coordinates[2]
-        )
-
-    # Define VTK Cells
-    vtk_cells = vtk.vtkCellArray()
-
-    vtk_cell_type = {
-        "quad": 9,
-        "tria": 5,
-        "tetra4": 10,
-        "hexa": 12,
-        "wedge": 13,
-        "tetra10": 24,
-        "hexa20": 25,
+            steps = parse_prnsol_file(resultfile)
+
+        file_steps = 0
+        for time_value, fields in steps:
+            file_steps += 1
+            yield (file_steps if time_value is None else time_value), fields
+
+        if file_steps == 0:
+            warnings.warn(f'No result steps found in result file: {resultfile}')
+
+
+def align_results(fields, index, n_points):
+    # Aligns the result values to the vtk points in one vectorized pass, points without a result get NaN
+    aligned = {}
+    for name, (ids, values) in fields.items():
+        vtk_ids = map_fem_ids(index, ids)
+        found = vtk_ids >= 0
+        field = np.full((n_points,) + values.shape[1:], np.nan, dtype=np.float32)
+        field[vtk_ids[found]] = values[found]
+        aligned[name] = field
+    return aligned
+
+# Corner node layout of each cell type used for the element quality metrics. Quadratic elements
+# are evaluated on their corner nodes only (first 4 nodes of tetra10, first 8 nodes of hexa20).
+QUALITY_CELL_LAYOUT = {
+    "tria": {
+        "corners": 3,
+        "edges": [(0, 1), (1, 2), (2, 0)],
+        "jacobian": [(0, 1, 2), (1, 2, 0), (2, 0, 1)],
+    },
+    "quad": {
+        "corners": 4,
+        "edges": [(0, 1), (1, 2), (2, 3), (3, 0)],
+        "jacobian": [(0, 1, 3), (1, 2, 0), (2, 3, 1), (3, 0, 2)],
+    },
+    "tetra": {
+        "corners": 4,
+        "edges": [(0, 1), (1, 2), (2, 0), (0, 3), (1, 3), (2, 3)],
+        "jacobian": [(0, 1, 2, 3), (1, 2, 0, 3), (2, 0, 1, 3), (3, 0, 2, 1)],
+    },
+    "hexa": {
+        "corners": 8,
+        "edges": [(0, 1), (1, 2), (2, 3), (3, 0), (4, 5), (5, 6), (6, 7), (7, 4),
+                  (0, 4), (1, 5), (2, 6), (3, 7)],
+        "jacobian": [(0, 1, 3, 4), (1, 2, 0, 5), (2, 3, 1, 6), (3, 0, 2, 7),
+                     (4, 7, 5, 0), (5, 4, 6, 1), (6, 5, 7, 2), (7, 6, 4, 3)],
+    },
+}
+
+# Split of a hexahedron into 6 tetrahedra around the diagonal 0-6 (volume computation)
+HEXA_TETRA_SPLIT = [(0, 1, 2, 6), (0, 2, 3, 6), (0, 3, 7, 6), (0, 7, 4, 6), (0, 4, 5, 6), (0, 5, 1, 6)]
+
+SCALED_JACOBIAN_BINS = [-1.0, 0.0, 0.2, 0.4, 0.6, 0.8, 1.0]
+
+
+# Quality cell layout of each VTK cell type
+QUALITY_CELL_TYPE = {
+    VTK_CELL_TYPE["tria"]: "tria",
+    VTK_CELL_TYPE["quad"]: "quad",
+    VTK_CELL_TYPE["tetra4"]: "tetra",
+    VTK_CELL_TYPE["tetra10"]: "tetra",
+    VTK_CELL_TYPE["hexa"]: "hexa",
+    VTK_CELL_TYPE["hexa20"]: "hexa",
+}
+
+
+def compute_element_quality(mesh):
+
+    coordinates = mesh.points.astype(np.float64)
+
+    n_cells = len(mesh.cell_types)
+    size = np.full(n_cells, np.nan)
+    aspect_ratio = np.full(n_cells, np.nan)
+    scaled_jacobian = np.full(n_cells, np.nan)
+    collapsed = np.zeros(n_cells, dtype=np.uint8)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for vtk_type, cell_type in QUALITY_CELL_TYPE.items():
+            cell_ids = np.flatnonzero(mesh.cell_types == vtk_type)
+            if len(cell_ids) == 0:
+                continue
+
+            layout = QUALITY_CELL_LAYOUT[cell_type]
+            # Corner connectivity of the cell type group, shape (cells, corners)
+            connectivity = mesh.connectivity[mesh.offsets[cell_ids][:, None] + np.arange(layout["corners"])]
+            # Corner coordinates, shape (cells, corners, 3)
+            xyz = coordinates[connectivity]
+
+            # Collapsed nodes: the same node attached to more than one corner
+            sorted_ids = np.sort(connectivity, axis=1)
+            collapsed[cell_ids] = np.any(sorted_ids[:, 1:] == sorted_ids[:, :-1], axis=1)
+
+            # Aspect ratio as longest over shortest edge
+            edges = np.asarray(layout["edges"])
+            edge_length = np.linalg.norm(xyz[:, edges[:, 1]] - xyz[:, edges[:, 0]], axis=2)
+            aspect_ratio[cell_ids] = edge_length.max(axis=1) / edge_length.min(axis=1)
+
+            corner = np.asarray(layout["jacobian"])
+            e1 = xyz[:, corner[:, 1]] - xyz[:, corner[:, 0]]
+            e2 = xyz[:, corner[:, 2]] - xyz[:, corner[:, 0]]
+            l1 = np.linalg.norm(e1, axis=2)
+            l2 = np.linalg.norm(e2, axis=2)
+
+            if cell_type == "tria":
+                cross = np.cross(xyz[:, 1] - xyz[:, 0], xyz[:, 2] - xyz[:, 0])
+                size[cell_ids] = 0.5 * np.linalg.norm(cross, axis=1)
+                corner_jacobian = np.linalg.norm(np.cross(e1, e2), axis=2) / (l1 * l2) * (2.0 / np.sqrt(3.0))
+
+            elif cell_type == "quad":
+                cross = np.cross(xyz[:, 2] - xyz[:, 0], xyz[:, 3] - xyz[:, 1])
+                cross_norm = np.linalg.norm(cross, axis=1)
+                size[cell_ids] = 0.5 * cross_norm
+                # Corner jacobians projected on the element normal, concave corners become negative
+                normal = cross / cross_norm[:, None]
+                corner_jacobian = np.einsum('ijk,ik->ij', np.cross(e1, e2), normal) / (l1 * l2)
+
+            else:
+                e3 = xyz[:, corner[:, 3]] - xyz[:, corner[:, 0]]
+                l3 = np.linalg.norm(e3, axis=2)
+                det = np.einsum('ijk,ijk->ij', np.cross(e1, e2), e3)
+                corner_jacobian = det / (l1 * l2 * l3)
+
+                if cell_type == "tetra":
+                    size[cell_ids] = det[:, 0] / 6.0
+                    corner_jacobian = corner_jacobian * np.sqrt(2.0)
+                else:
+                    tetra = np.asarray(HEXA_TETRA_SPLIT)
+                    t0 = xyz[:, tetra[:, 0]]
+                    size[cell_ids] = np.einsum('ijk,ijk->ij', np.cross(xyz[:, tetra[:, 1]] - t0,
+                                                                       xyz[:, tetra[:, 2]] - t0),
+                                               xyz[:, tetra[:, 3]] - t0).sum(axis=1) / 6.0
+
+            # Zero length edges at a corner give a zero jacobian at that corner
+            corner_jacobian = np.nan_to_num(corner_jacobian, nan=0.0, posinf=0.0, neginf=0.0)
+            scaled_jacobian[cell_ids] = np.clip(corner_jacobian.min(axis=1), -1.0, 1.0)
+
+    return {
+        "CELL_SIZE": size,
+        "ASPECT_RATIO": aspect_ratio,
+        "SCALED_JACOBIAN": scaled_jacobian,
+        "COLLAPSED_NODES": collapsed,
     }
 
-    vtk_cell_type_no = []
-
-    for eid in elements.keys():
-        
-        # Quad elements
-        if len(elements[eid].attached_nodes) == 4 and '181' in elem_type_list:
-            quad = vtk.vtkQuad()
-            for i in range(len(elements[eid].attached_nodes)):
-                quad.GetPointIds().SetId(i, elements[eid].attached_nodes[i])
-            vtk_cells.InsertNextCell(quad)
-            vtk_cell_type_no.append(vtk_cell_type["quad"])
-
-        # Tria elements
-        elif len(elements[eid].attached_nodes) == 3 and '181' in elem_type_list:
-            tria = vtk.vtkTriangle()
-            for i in range(len(elements[eid].attached_nodes)):
-                tria.GetPointIds().SetId(i, elements[eid].attached_nodes[i])
-            vtk_cells.InsertNextCell(tria)
-            vtk_cell_type_no.append(vtk_cell_type["tria"])
-
-        # Tetra elements
-        elif len(elements[eid].attached_nodes) == 4 and '185' in elem_type_list:
-            tetra4 = vtk.vtkTetra()
-            for i in range(len(elements[eid].attached_nodes)):
-                tetra4.GetPointIds().SetId(i, elements[eid].attached_nodes[i])
-            vtk_cells.InsertNextCell(tetra4)
-            vtk_cell_type_no.append(vtk_cell_type["tetra4"])
-
-        # Hexa elements
-        elif len(elements[eid].attached_nodes) == 8 and '185' in elem_type_list:
-            hexa = vtk.vtkHexahedron()
-            for i in range(len(elements[eid].attached_nodes)):
-                hexa.GetPointIds().SetId(i, elements[eid].attached_nodes[i])
-            vtk_cells.InsertNextCell(hexa)
-            vtk_cell_type_no.append(vtk_cell_type["hexa"])
-
-        # Tetrahedra (2nd order) elements
-        elif len(elements[eid].attached_nodes) == 10 and '187' in elem_type_list:
-            tetra10 = vtk.vtkQuadraticTetra()
-            for i in range(len(elements[eid].attached_nodes)):
-                tetra10.GetPointIds().SetId(i, elements[eid].attached_nodes[i])
-            vtk_cells.InsertNextCell(tetra10)
-            vtk_cell_type_no.append(vtk_cell_type["tetra10"])
- 
-       # Hexahedra (2nd order) elements
-        elif len(elements[eid].attached_nodes) == 20 and '186' in elem_type_list:
-            hexa20 = vtk.vtkQuadraticHexahedron()
-            for i in range(len(elements[eid].attached_nodes)):
-                hexa20.GetPointIds().SetId(i, elements[eid].attached_nodes[i])
-            vtk_cells.InsertNextCell(hexa20)
-            vtk_cell_type_no.append(vtk_cell_type["hexa20"]) 
-
-        # Penta elements (SOON AVAILABLE)
-        elif len(elements[eid].attached_nodes) == 6 and 'CPENTA' in elem_type_list:
-            wedge = vtk.vtkWedge()
-            for i in range(len(elements[eid].attached_nodes)):
-                wedge.GetPointIds().SetId(i, elements[eid].attached_nodes[i])
-            vtk_cells.InsertNextCell(wedge)
-            vtk_cell_type_no.append(vtk_cell_type["wedge"])
-
-        # Pyramid elements (SOON AVAILABLE)
 
+def print_quality_summary(quality):
+    scaled_jacobian = quality["SCALED_JACOBIAN"]
+    aspect_ratio = quality["ASPECT_RATIO"]
+
+    evaluated = ~np.isnan(scaled_jacobian)
+    counts, _ = np.histogram(scaled_jacobian[evaluated], bins=SCALED_JACOBIAN_BINS)
+
+    print(f'   Element Quality (evaluated cells: {np.count_nonzero(evaluated)}):')
+    print(f'      Scaled Jacobian histogram:')
+    for i in range(len(counts)):
+        bracket = ']' if i == len(counts) - 1 else ')'
+        print(f'         [{SCALED_JACOBIAN_BINS[i]:5.2f}, {SCALED_JACOBIAN_BINS[i+1]:5.2f}{bracket}: {counts[i]}')
+    if np.any(evaluated):
+        print(f'      Scaled Jacobian min: {np.min(scaled_jacobian[evaluated]):.4f}')
+        print(f'      Aspect ratio max   : {np.max(aspect_ratio[evaluated]):.4f}')
+    print(f'      Collapsed node cells: {np.count_nonzero(quality["COLLAPSED_NODES"])}')
+
+
+def write_vtk(mesh, outputfile, dataModeASCII, fem_node_string, fem_element_string, element_quality=False,
+              fem_components=None):
     # Create unstructured grid
-    ugrid = vtk.vtkUnstructuredGrid()
-    ugrid.SetPoints(vtk_points)
-    ugrid.SetCells(vtk_cell_type_no, vtk_cells)
-
-    # Mapping of FEM node and element ids to vtu model
-    if fem_node_string:
-        fem_node_id = vtk.vtkIntArray()
-        fem_node_id.SetNumberOfComponents(1)
-        fem_node_id.SetName("FEM_NODE_ID")
-        for nid in nodes.keys():
-            fem_node_id.InsertNextValue(int(nodes[nid].nid))
-        # Add the point data to the VTK unstructured dataset
-        ugrid.GetPointData().AddArray(fem_node_id)
-
-    if fem_element_string:
-        fem_element_id = vtk.vtkIntArray()
-        fem_element_id.SetNumberOfComponents(1)
-        fem_element_id.SetName("FEM_ELEMENT_ID")
-        for eid in elements.keys():
-            fem_element_id.InsertNextValue(int(elements[eid].eid))
-        # Add the cell data to the VTK unstructured dataset
-        ugrid.GetCellData().AddArray(fem_element_id)
+    ugrid = mesh.to_vtk(fem_node_string, fem_element_string)
+
+    # Element quality metrics as cell data
+    quality = {}
+    if element_quality:
+        quality = compute_element_quality(mesh)
+        for name, values in quality.items():
+            quality_array = numpy_support.numpy_to_vtk(values, deep=1)
+            quality_array.SetName(name)
+            ugrid.GetCellData().AddArray(quality_array)
+
+    # Named components (CMBLOCK) as point and cell masks
+    if fem_components:
+        point_arrays, cell_arrays, field_names = component_arrays(mesh, fem_components == 'bits')
+        for arrays, attributes in [(point_arrays, ugrid.GetPointData()), (cell_arrays, ugrid.GetCellData())]:
+            for name, values in arrays.items():
+                component_array = numpy_support.numpy_to_vtk(values, deep=1)
+                component_array.SetName(name)
+                attributes.AddArray(component_array)
+        for name, names in field_names.items():
+            component_names = vtk.vtkStringArray()
+            component_names.SetName(name)
+            for cm_name in names:
+                component_names.InsertNextValue(cm_name)
+            ugrid.GetFieldData().AddArray(component_names)
 
     # Write to binary file
     writer = vtk.vtkXMLUnstructuredGridWriter()
@@ -312,29 +946,110 @@ def write_vtk(nodes, elements, elem_type_list, outputfile, dataModeASCII, fem_no
 
     print(f'')
     print(f'VTK Summary:')
-    print(f'   Number of Points: {vtk_points.GetNumberOfPoints()}')
-    print(f'   Number of Cells : {vtk_cells.GetNumberOfCells()}')
+    print(f'   Number of Points: {ugrid.GetNumberOfPoints()}')
+    print(f'   Number of Cells : {ugrid.GetNumberOfCells()}')
+    if quality:
+        print_quality_summary(quality)
+    if fem_components:
+        print(f'   Number of Components: {len(mesh.components)}')
     print(f'   Writing output file: {outputfile}')
 
-if __name__ == '__main__':
+class ResultSteps(VTKPythonAlgorithmBase):
+    # Temporal source for the vtkHDFWriter: every time step is the (shared) mesh geometry with the point fields
+    # of that step. Points and cells are the same objects in all steps, so the writer stores them only once.
+    # The result values of a step are aligned to the points only when the step is requested, so only one step
+    # is held as point arrays at a time.
+    def __init__(self, geometry, steps, index, shapes):
+        VTKPythonAlgorithmBase.__init__(self, nInputPorts=0, nOutputPorts=1, outputType='vtkUnstructuredGrid')
+        self.geometry = geometry
+        self.steps = steps
+        self.index = index
+        self.shapes = shapes
+
+    def RequestInformation(self, request, inInfo, outInfo):
+        info = outInfo.GetInformationObject(0)
+        time_values = [time_value for time_value, _ in self.steps]
+        info.Remove(vtk.vtkStreamingDemandDrivenPipeline.TIME_STEPS())
+        for time_value in time_values:
+            info.Append(vtk.vtkStreamingDemandDrivenPipeline.TIME_STEPS(), time_value)
+        info.Set(vtk.vtkStreamingDemandDrivenPipeline.TIME_RANGE(), [time_values[0], time_values[-1]], 2)
+        return 1
+
+    def RequestData(self, request, inInfo, outInfo):
+        info = outInfo.GetInformationObject(0)
+        update_time = info.Get(vtk.vtkStreamingDemandDrivenPipeline.UPDATE_TIME_STEP())
+        step_no = int(np.argmin([abs(time_value - update_time) for time_value, _ in self.steps]))
+        time_value, fields = self.steps[step_no]
+
+        # Every time step needs the same arrays, fields missing in a step are filled with NaN
+        n_points = self.geometry.GetNumberOfPoints()
+        aligned = align_results(fields, self.index, n_points)
+        for name, shape in self.shapes.items():
+            if name not in aligned:
+                aligned[name] = np.full((n_points,) + shape, np.nan, dtype=np.float32)
+
+        output = vtk.vtkUnstructuredGrid.GetData(outInfo)
+        output.ShallowCopy(self.geometry)
+        for name, values in aligned.items():
+            field_array = numpy_support.numpy_to_vtk(values, deep=1)
+            field_array.SetName(name)
+            output.GetPointData().AddArray(field_array)
+        output.GetInformation().Set(vtk.vtkDataObject.DATA_TIME_STEP(), time_value)
+        return 1
+
+
+def write_results(mesh, resultfiles, outputfile):
+    # Writes all result steps to one transient VTKHDF file next to outputfile. The mesh geometry is stored once,
+    # every time step only adds its point fields.
+    # Steps with the same time (e.g. one result file per quantity) are merged into one time step. The steps keep
+    # the parsed (fem node ids, values) and are aligned to the points one by one while writing.
+    steps = {}
+    for time_value, fields in read_results(resultfiles):
+        step_fields = steps.setdefault(time_value, {})
+        for name in fields.keys() & step_fields.keys():
+            raise ValueError(f'Several result steps with the time value {time_value} contain the field {name}, '
+                             f'every step needs a unique time (load step time or Nastran subcase id)')
+        step_fields.update(fields)
+
+    if not steps:
+        raise ValueError(f'No result steps found in the result files: {", ".join(resultfiles)}')
+
+    steps = sorted(steps.items(), key=lambda step: step[0])
+
+    # Number of components of every field (scalar or vector)
+    shapes = {}
+    for _, fields in steps:
+        for name, (_, values) in fields.items():
+            shapes.setdefault(name, values.shape[1:])
+
+    result_steps = ResultSteps(mesh.to_vtk(fem_node_string=False, fem_element_string=False), steps,
+                               fem_id_index(mesh.fem_node_ids), shapes)
+    hdf_file = os.path.splitext(os.path.abspath(outputfile))[0] + '.vtkhdf'
+    writer = vtk.vtkHDFWriter()
+    writer.SetInputConnection(result_steps.GetOutputPort())
+    writer.SetFileName(hdf_file)
+    writer.SetWriteAllTimeSteps(True)
+    writer.Write()
 
     print(f'')
-    print(f'==================================================')
-    print(f'                     _     ____        _   _      ')
-    print(f' _ __ ___   ___  ___| |__ |___ \__   _| |_| | __  ')
-    print(f"| '_  _ \ / _ \/ __| '_ \  __) \ \ / / __| |/ /  ")
-    print(f'| | | | | |  __/\__ \ | | |/ __/ \ V /| |_|   <   ')
-    print(f'|_| |_| |_|\___||___/_| |_|_____| \_/  \__|_|\_\  ')
-    print(f'')
-    print(f'==================================================')
+    print(f'Results Summary:')
+    print(f'   Number of Steps : {len(steps)}')
+    print(f'   Time values     : {steps[0][0]} ... {steps[-1][0]}')
+    print(f'   Writing result file: {hdf_file}')
 
-    args = ParseArgs()
 
+def convert(args, previous=None):
+    # Converts the input file. previous is the (block cache, block hashes) of the last run, blocks found in its
+    # cache are not parsed again. Returns the (block cache, block hashes) of this run.
+    block_cache, block_hashes = previous if previous is not None else (None, None)
     inputfile = args.inputfile
     outputfile = args.outputfile
     dataModeASCII = args.ascii
     fem_node_string = args.fem_node_string
     fem_element_string = args.fem_element_string
+    element_quality = args.element_quality
+    fem_components = args.fem_components
+    resultfiles = args.results
 
     print(f'')
     
@@ -345,23 +1060,100 @@ if __name__ == '__main__':
     
     start_time = time.time()
 
-    nodes, elements, elem_type_list, temp = parse_ansys_file(inputfile)
+    input_stream = InputStream(inputfile)
+    mesh, new_block_cache, new_block_hashes = parse_ansys_file(input_stream, block_cache)
 
-    #************************ FOR DEBUGGING
-    #for nid in nodes.keys():
-    #    print(nodes[nid].nid, nodes[nid].vtk_nid, nodes[nid].coordinates)
+    if block_cache is not None:
+        parsed_blocks = len(new_block_cache.keys() - block_cache.keys())
+        print(f'Parsed blocks: {parsed_blocks} of {len(new_block_cache)} (unchanged blocks reused)')
 
-    #for eid in elements.keys():
-    #    print(elements[eid].vtk_eid, elements[eid].attached_nodes)
-
-    # print(temp)
-    #************************
+    # Blocks may be reordered or repeated without any new block, compare the blocks in file order
+    if block_hashes is not None and new_block_hashes == block_hashes:
+        print(f'No block changed, output files are up to date.')
+    else:
+        print(f'Write vtu file ...')
+        write_vtk(mesh, outputfile, dataModeASCII, fem_node_string, fem_element_string, element_quality,
+                  fem_components)
 
-    print(f'Write vtu file ...')
-    write_vtk(nodes, elements, elem_type_list, outputfile, dataModeASCII, fem_node_string, fem_element_string)
+        if resultfiles:
+            print(f'Write result steps ...')
+            write_results(mesh, resultfiles, outputfile)
 
     end_time = time.time()
 
     print(f'')
+    print(f'Input: {input_stream.bytes_read / 1e6:.3f} MB read in {input_stream.elapsed:.3f} seconds '
+          f'({input_stream.bytes_read / 1e6 / max(input_stream.elapsed, 1e-9):.1f} MB/s)')
     print(f'Elapsed time: {(end_time - start_time):.3f} seconds')
-    print(f'Done.')
\ No newline at end of file
+    print(f'Done.')
+
+    return new_block_cache, new_block_hashes
+
+
+def watch(args, previous=None):
+    # Polls the input file and reconverts it on every change, only changed blocks are parsed again
+    def file_state():
+        try:
+            stat = os.stat(args.inputfile)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            # Editors may replace the file while saving
+            return None
+
+    last_state = file_state()
+    print(f'')
+    print(f'Watching input file: {args.inputfile} (Ctrl+C to stop)')
+
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            state = file_state()
+            if state is None or state == last_state:
+                continue
+            last_state = state
+
+            print(f'')
+            print(f'Input file changed, reconverting ...')
+            try:
+                previous = convert(args, previous)
+            except Exception as e:
+                # Keep watching, the file may be saved again in a consistent state
+                print(f'Conversion failed: {e!r}')
+    except KeyboardInterrupt:
+        print(f'')
+        print(f'Stopped watching.')
+
+
+if __name__ == '__main__':
+
+    print(f'')
+    print(f'==================================================')
+    print(f'                     _     ____        _   _      ')
+    print(f' _ __ ___   ___  ___| |__ |___ \__   _| |_| | __  ')
+    print(f"| '_  _ \ / _ \/ __| '_ \  __) \ \ / / __| |/ /  ")
+    print(f'| | | | | |  __/\__ \ | | |/ __/ \ V /| |_|   <   ')
+    print(f'|_| |_| |_|\___||___/_| |_|_____| \_/  \__|_|\_\  ')
+    print(f'')
+    print(f'==================================================')
+
+    args = ParseArgs()
+
+    if args.watch and args.inputfile == '-':
+        print(f'--watch needs an input file, stdin can not be watched.')
+        sys.exit(2)
+
+    if args.results and not hasattr(vtk, 'vtkHDFWriter'):
+        print(f'--results needs VTK 9.4 or higher (vtkHDFWriter), installed VTK version: '
+              f'{vtk.vtkVersion.GetVTKVersion()}')
+        sys.exit(2)
+
+    if args.watch:
+        previous = None
+        try:
+            previous = convert(args)
+        except Exception as e:
+            # Start watching anyway, the input file may be fixed while watching
+            print(f'Conversion failed: {e!r}')
+        watch(args, previous)
+    else:
+        convert(args)